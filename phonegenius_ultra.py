@@ -24,21 +24,50 @@ NEW (Fast):  WebSocket Stream → Gemini tokens stream → TTS stream in real-ti
 This is the difference between:
 - Customer waits for response (feels like machine)
 - Response generates while customer hears it (feels like human thinking)
+
+DEPLOYMENT NOTES:
+=================
+Each call's TTS thread asks for SCHED_FIFO priority and a dedicated CPU so
+Twilio-timed sends aren't preempted by HTTP handlers. That needs
+CAP_SYS_NICE; without it the thread runs at normal priority (one warning).
+- Docker / DigitalOcean:  docker run --cap-add SYS_NICE ...
+- Fly.io:                 VMs run as root - works out of the box
+- Railway / Render:       no extra capabilities - runs unpinned
+Pick the core with PHONEGENIUS_AUDIO_CPU (default: highest available CPU).
 """
 
 import json
 import os
 import sys
 import asyncio
-import base64
+import binascii
+import ctypes
+import io
+import threading
+import time
 import uuid
-from datetime import datetime
-from pathlib import Path
-
-# Flask & WebSocket
-from flask import Flask, render_template_string, jsonify, request
-from flask_cors import CORS
-from flask_sock import Sock
+import wave
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from multiprocessing import Value
+from xml.sax.saxutils import quoteattr
+from binascii import a2b_base64, b2a_base64
+
+import orjson
+
+# ASGI server & WebSocket
+import uvicorn
+from fastapi import Body, FastAPI, Request, WebSocket, WebSocketDisconnect
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import HTMLResponse, Response
+
+# libuv-backed event loop for the socket-heavy Twilio + Gemini traffic.
+# Installed before any loop exists; not available on Windows.
+try:
+    import uvloop
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+except ImportError:
+    uvloop = None
 
 # Twilio
 from twilio.rest import Client
@@ -49,20 +78,36 @@ import twilio.twiml.messaging_response as MessagingResponse
 import google.generativeai as genai
 
 # Audio processing
+import numpy as np
+from numba import njit
+
 try:
     import pyaudio
-    import numpy as np
 except ImportError:
     print("Installing audio libraries...")
-    os.system("pip install pyaudio numpy --quiet")
+    os.system("pip install pyaudio --quiet")
 
 # ═══════════════════════════════════════════════════════════════════════════
 #  FAST CONFIGURATION LOADER
 # ═══════════════════════════════════════════════════════════════════════════
 
+def env_config():
+    """Config from environment variables"""
+    return {
+        'twilio_sid': os.getenv('TWILIO_ACCOUNT_SID'),
+        'twilio_auth': os.getenv('TWILIO_AUTH_TOKEN'),
+        'twilio_phone': os.getenv('TWILIO_OUTBOUND_NUMBER'),
+        'gemini_key': os.getenv('GEMINI_API_KEY'),
+    }
+
 def load_config():
     """Load config from file or env - handles multiple locations"""
     
+    # Env-configured deployments (Railway, Render, Fly.io) skip file probing
+    if os.getenv('TWILIO_ACCOUNT_SID'):
+        print("✓ Config loaded from environment variables")
+        return env_config()
+    
     # Try multiple paths
     paths = [
         'config.json',
@@ -72,7 +117,7 @@ def load_config():
     ]
     
     for path in paths:
-        if Path(path).exists():
+        if os.path.exists(path):
             try:
                 with open(path, 'r') as f:
                     config = json.load(f)
@@ -87,12 +132,7 @@ def load_config():
     
     # Fallback to environment variables
     print("⚠️ config.json not found. Using environment variables...")
-    return {
-        'twilio_sid': os.getenv('TWILIO_ACCOUNT_SID'),
-        'twilio_auth': os.getenv('TWILIO_AUTH_TOKEN'),
-        'twilio_phone': os.getenv('TWILIO_OUTBOUND_NUMBER'),
-        'gemini_key': os.getenv('GEMINI_API_KEY'),
-    }
+    return env_config()
 
 CONFIG = load_config()
 
@@ -127,22 +167,254 @@ print("✓ Twilio configured")
 print("✓ Gemini configured")
 
 # ═══════════════════════════════════════════════════════════════════════════
-#  FLASK SETUP
+#  APP SETUP
 # ═══════════════════════════════════════════════════════════════════════════
 
-app = Flask(__name__)
-CORS(app)
-sock = Sock(app)
-
-# Global state
-ACTIVE_CALLS = {}
+@asynccontextmanager
+async def lifespan(app):
+    # In the background: a slow Gemini endpoint must not hold up serving calls
+    warmup = asyncio.create_task(warm_gemini())
+    yield
+    warmup.cancel()
+
+# ASGI: every call's WebSocket shares one event loop instead of a thread each
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])
+
+# Global state - bounded so a long-running server can't grow without limit.
+# Calls are removed when their stream closes; placed-but-never-answered calls
+# are evicted oldest-first.
+MAX_ACTIVE_CALLS = 1024
+TRANSCRIPT_MAX_TURNS = 256
+ACTIVE_CALLS = OrderedDict()
+
+# Lock-backed counters: increments take the Value's lock, so they stay exact
+# on free-threaded builds too; reads don't. They are per-process - each
+# uvicorn worker would count on its own, and the Procfile runs one.
 METRICS = {
-    'calls_made': 0,
-    'calls_connected': 0,
-    'conversions': 0,
-    'total_minutes': 0,
+    'calls_made': Value('q', 0),
+    'calls_connected': Value('q', 0),
+    'conversions': Value('q', 0),
+    'total_minutes': Value('d', 0.0),
 }
 
+def bump_metric(name, amount=1):
+    """Atomically add to a metric counter"""
+    counter = METRICS[name]
+    with counter.get_lock():
+        counter.value += amount
+
+def metrics_snapshot():
+    """Plain-dict copy of METRICS for the API"""
+    return {name: counter.value for name, counter in METRICS.items()}
+
+def register_call(call_sid, call):
+    """Add/refresh a call in ACTIVE_CALLS, evicting the oldest past the cap"""
+    ACTIVE_CALLS[call_sid] = call
+    ACTIVE_CALLS.move_to_end(call_sid)
+    while len(ACTIVE_CALLS) > MAX_ACTIVE_CALLS:
+        ACTIVE_CALLS.popitem(last=False)
+
+# ═══════════════════════════════════════════════════════════════════════════
+#  LOCK-FREE AUDIO RING (WebSocket reader → Gemini worker)
+# ═══════════════════════════════════════════════════════════════════════════
+
+FRAME_SIZE = 160     # 20ms of 8kHz µ-law - one Twilio media frame
+RING_SLOTS = 256     # ~5 seconds of audio; power of two so wrap is a mask
+
+class SPSCRing:
+    """
+    Single-producer / single-consumer ring of fixed-size audio slots.
+    
+    The producer (e.g. the WebSocket reader) is the only writer of `tail`,
+    the consumer (e.g. the call worker) the only writer of `head`, so
+    neither side ever takes a lock. The slot is
+    filled before `tail` is bumped (release) and `tail` is read before the
+    slot is copied out (acquire).
+    """
+    
+    def __init__(self, slots=RING_SLOTS, slot_size=FRAME_SIZE):
+        if slots & (slots - 1):
+            raise ValueError("slots must be a power of two")
+        self.mask = slots - 1
+        self.slot_size = slot_size
+        self.buf = bytearray(slots * slot_size)
+        self.view = memoryview(self.buf)
+        self.lengths = (ctypes.c_uint32 * slots)()
+        self.head = ctypes.c_uint64(0)
+        self.tail = ctypes.c_uint64(0)
+    
+    def push(self, data):
+        """Copy one frame into the ring. Returns False (frame dropped) when full."""
+        tail = self.tail.value
+        if tail - self.head.value > self.mask:
+            return False
+        
+        n = len(data)
+        if n > self.slot_size:
+            data = data[:self.slot_size]
+            n = self.slot_size
+        
+        i = tail & self.mask
+        start = i * self.slot_size
+        self.view[start:start + n] = data
+        self.lengths[i] = n
+        self.tail.value = tail + 1
+        return True
+    
+    def drain(self):
+        """Copy out every queued frame as one contiguous bytes object (b'' when empty)."""
+        head = self.head.value
+        tail = self.tail.value
+        if head == tail:
+            return b''
+        
+        view, lengths, size, mask = self.view, self.lengths, self.slot_size, self.mask
+        frames = []
+        for seq in range(head, tail):
+            i = seq & mask
+            start = i * size
+            frames.append(view[start:start + lengths[i]])
+        audio = b''.join(frames)
+        
+        self.head.value = tail
+        return audio
+    
+    def pop(self):
+        """Copy out the oldest slot, or None when empty."""
+        head = self.head.value
+        if head == self.tail.value:
+            return None
+        
+        i = head & self.mask
+        start = i * self.slot_size
+        data = self.view[start:start + self.lengths[i]].tobytes()
+        
+        self.head.value = head + 1
+        return data
+
+# ═══════════════════════════════════════════════════════════════════════════
+#  DOUBLE-BUFFERED PLAYBACK (TTS thread → WebSocket writer)
+# ═══════════════════════════════════════════════════════════════════════════
+
+PHRASE_SLOTS = 16          # phrases queued for the TTS thread
+MAX_PHRASE_BYTES = 1024    # longer phrases are split across slots
+MAX_FRAME_BYTES = 2048     # one framed + base64'd slot; TTS output is split to fit
+
+class DoubleBuffer:
+    """
+    Two preallocated frame slots passed back and forth between one writer
+    thread (TTS) and one reader (the WebSocket writer task).
+    
+    The writer fills slot i, sets ready[i] and moves to i^1; the reader
+    sends slot j straight out of the buffer, clears ready[j] and moves to
+    j^1. While phrase N is being sent, phrase N+1 is being synthesized.
+    """
+    
+    def __init__(self, size=MAX_FRAME_BYTES):
+        self.size = size
+        self.views = (memoryview(bytearray(size)), memoryview(bytearray(size)))
+        self.lengths = (ctypes.c_uint32 * 2)()
+        self.ready = (ctypes.c_uint8 * 2)()
+        self.write_idx = 0   # touched only by the writer
+        self.read_idx = 0    # touched only by the reader
+    
+    def write(self, data):
+        """Fill the next slot. Returns False while the reader still owns it."""
+        i = self.write_idx
+        if self.ready[i]:
+            return False
+        
+        n = len(data)
+        if n > self.size:
+            raise ValueError(f"frame of {n} bytes exceeds {self.size}-byte slot")
+        self.views[i][:n] = data
+        self.lengths[i] = n
+        self.ready[i] = 1
+        self.write_idx = i ^ 1
+        return True
+    
+    def peek(self):
+        """View of the next ready slot, or None. Call release() once it's sent."""
+        j = self.read_idx
+        if not self.ready[j]:
+            return None
+        return self.views[j][:self.lengths[j]]
+    
+    def release(self):
+        """Hand the slot returned by peek() back to the writer."""
+        j = self.read_idx
+        self.ready[j] = 0
+        self.read_idx = j ^ 1
+
+# ═══════════════════════════════════════════════════════════════════════════
+#  µ-LAW ↔ PCM16 LOOKUP TABLES
+# ═══════════════════════════════════════════════════════════════════════════
+
+SAMPLE_RATE = 8000          # Twilio Media Streams: 8kHz mono µ-law
+GEMINI_SAMPLE_RATE = 16000  # what Gemini's audio input expects
+
+def _mulaw_decode(byte):
+    """G.711 µ-law byte → linear PCM16 sample (only used to build the LUT)"""
+    byte = ~byte & 0xFF
+    sign = byte & 0x80
+    exponent = (byte >> 4) & 0x07
+    mantissa = byte & 0x0F
+    sample = (((mantissa << 3) + 0x84) << exponent) - 0x84
+    return -sample if sign else sample
+
+MU_LAW_LUT = np.array([_mulaw_decode(i) for i in range(256)], dtype=np.int16)
+
+# Inverse: every int16 value maps to the µ-law code whose level is nearest,
+# found by searching the midpoints between the sorted decode levels
+_MU_LAW_ORDER = np.argsort(MU_LAW_LUT, kind='stable')
+_MU_LAW_LEVELS = MU_LAW_LUT[_MU_LAW_ORDER].astype(np.int32)
+_MU_LAW_BOUNDARIES = (_MU_LAW_LEVELS[:-1] + _MU_LAW_LEVELS[1:]) // 2
+PCM_TO_MULAW_LUT = _MU_LAW_ORDER[
+    np.searchsorted(_MU_LAW_BOUNDARIES, np.arange(-32768, 32768), side='right')
+].astype(np.uint8)
+
+def pcm16_to_mulaw(samples):
+    """int16 ndarray → µ-law bytes"""
+    return PCM_TO_MULAW_LUT[samples.astype(np.int32) + 32768].tobytes()
+
+@njit(cache=True)
+def decode_resample(mulaw):
+    """µ-law uint8 array at 8kHz → int16 PCM at 16kHz (linear interpolation)"""
+    n = mulaw.shape[0]
+    out = np.empty(2 * n, dtype=np.int16)
+    if n == 0:
+        return out
+    
+    lut = MU_LAW_LUT
+    prev = np.int32(lut[mulaw[0]])
+    for i in range(1, n):
+        cur = np.int32(lut[mulaw[i]])
+        out[2 * i - 2] = prev
+        out[2 * i - 1] = (prev + cur) >> 1
+        prev = cur
+    out[2 * n - 2] = prev
+    out[2 * n - 1] = prev
+    return out
+
+def mulaw_to_pcm16_resample(audio):
+    """µ-law bytes at 8kHz → int16 ndarray at 16kHz (compiled kernel)"""
+    return decode_resample(np.frombuffer(audio, dtype=np.uint8))
+
+# Compile now (or load from cache) so the first call doesn't pay for it.
+# frombuffer gives a read-only array - the same signature the worker uses.
+mulaw_to_pcm16_resample(bytes(FRAME_SIZE))
+
+def pcm16_wav(samples, rate=SAMPLE_RATE):
+    """Wrap int16 samples in a WAV container for Gemini's audio input"""
+    out = io.BytesIO()
+    with wave.open(out, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(samples.tobytes())
+    return out.getvalue()
+
 # ═══════════════════════════════════════════════════════════════════════════
 #  ELITE SALES SCRIPTS (Same as Elite version)
 # ═══════════════════════════════════════════════════════════════════════════
@@ -155,38 +427,346 @@ ELITE_OPENINGS = {
     'consulting': "Hi {name}, your ideal clients call after 5 PM when you're not available. 47% of consulting inquiries happen after hours. Are you interested in capturing those calls going to competitors?",
 }
 
+# Outbound media frames have a fixed shape, so they're assembled from a
+# bytes template instead of building a dict and serialising it
+MEDIA_FRAME_HEAD = b'{"event":"media","media":{"payload":"'
+MEDIA_FRAME_TAIL = b'"}}'
+
+def media_frame_bytes(audio):
+    """Bytes → Media Streams 'media' frame, as ASCII bytes"""
+    return MEDIA_FRAME_HEAD + b2a_base64(audio, newline=False) + MEDIA_FRAME_TAIL
+
+# Most audio one MAX_FRAME_BYTES slot can carry once base64'd and framed
+MAX_FRAME_AUDIO_BYTES = (MAX_FRAME_BYTES - len(MEDIA_FRAME_HEAD) - len(MEDIA_FRAME_TAIL)) // 4 * 3
+
+def media_frame(audio):
+    """Bytes → Media Streams 'media' frame (str: Twilio only accepts text frames)"""
+    return media_frame_bytes(audio).decode()
+
+def render_opening_frame(industry, name):
+    """Render an opening into a ready-to-send Media Streams frame (done once per call, off the WS path)"""
+    opening = ELITE_OPENINGS.get(industry, ELITE_OPENINGS['restaurant']).format(name=name or 'there')
+    return media_frame(opening.encode())
+
+# Used for calls that weren't placed through /api/call/make
+DEFAULT_OPENING_FRAME = render_opening_frame('restaurant', None)
+
+# Per-turn prompts, specialised per industry at startup so the call worker
+# only does a dict + list index. The last prompt repeats for later turns.
+INDUSTRY_BUSINESSES = {
+    'restaurant': 'restaurant',
+    'dental': 'dental practice',
+    'legal': 'law firm',
+    'realestate': 'real estate agency',
+    'consulting': 'consulting firm',
+}
+
+PROMPT_TEMPLATES = [
+    "You are on a sales call with a {business} owner who just heard your opening. Respond naturally in 1-2 sentences.",
+    "You are on a sales call with a {business} owner. Address what they said and ask one question about their missed calls. Respond naturally in 1-2 sentences.",
+    "You are on a sales call with a {business} owner. Handle any objection and propose a 15-minute follow-up. Respond naturally in 1-2 sentences.",
+]
+
+PROMPT_TABLES = {
+    industry: [tmpl.format_map({'business': business}) for tmpl in PROMPT_TEMPLATES]
+    for industry, business in INDUSTRY_BUSINESSES.items()
+}
+
 # ═══════════════════════════════════════════════════════════════════════════
 #  STREAMING GEMINI RESPONSES (REAL-TIME)
 # ═══════════════════════════════════════════════════════════════════════════
 
-async def stream_gemini_response(prompt):
-    """Stream Gemini tokens in real-time (no waiting for full response)"""
+async def stream_gemini_response(prompt, on_token, audio=None):
+    """Stream Gemini tokens in real-time, calling on_token(bytes) as each arrives"""
     try:
+        contents = prompt
+        if audio is not None:
+            # Customer audio rides along with the prompt
+            contents = [prompt, {'mime_type': 'audio/wav', 'data': pcm16_wav(audio, GEMINI_SAMPLE_RATE)}]
+        
         # Use streaming for immediate token-by-token response
-        response = gemini_model.generate_content(
-            prompt,
+        response = await gemini_model.generate_content_async(
+            contents,
             stream=True,
             generation_config={"max_output_tokens": 100, "temperature": 0.8}
         )
         
-        full_response = ""
-        for chunk in response:
-            if chunk.text:
-                full_response += chunk.text
-                # Yield tokens as they arrive (real-time streaming)
-                yield chunk.text
-        
-        return 
+        async for chunk in response:
+            text = chunk.text
+            if text:
+                # Hand tokens over as they arrive (real-time streaming)
+                on_token(text.encode())
     except Exception as e:
         print(f"Gemini error: {e}")
-        yield "I understand. Tell me more about your situation."
+        on_token(b"I understand. Tell me more about your situation.")
+
+GEMINI_WARMUP_TIMEOUT = 10
+
+async def warm_gemini():
+    """
+    Open the Gemini connection before the first call needs it.
+    The async client keeps one HTTP/2 (gRPC) channel per event loop, so a
+    1-token request here moves the TLS handshake off the first call's
+    first-token latency.
+    """
+    try:
+        await asyncio.wait_for(
+            gemini_model.generate_content_async(
+                "ping",
+                generation_config={"max_output_tokens": 1}
+            ),
+            timeout=GEMINI_WARMUP_TIMEOUT
+        )
+        print("✓ Gemini connection warmed")
+    except asyncio.TimeoutError:
+        print(f"⚠️ Gemini warm-up timed out after {GEMINI_WARMUP_TIMEOUT}s")
+    except Exception as e:
+        print(f"⚠️ Gemini warm-up failed: {e}")
+
+# Tokens are batched into phrases before they go out: one frame per
+# sub-word token means one JSON encode + b64 + WebSocket write per token.
+PHRASE_ENDINGS = (b'.', b'!', b'?')
+PHRASE_MAX_BYTES = 48
+PHRASE_MAX_SECONDS = 0.120
+
+async def handle_stream(phrases, prompt, audio=None):
+    """Queue Gemini output phrase by phrase for the TTS thread"""
+    push = phrases.push
+    size = phrases.slot_size
+    loop = asyncio.get_running_loop()
+    buf = bytearray()
+    timer = None
+    
+    # Phrases the ring had no room for, pushed in order once it frees up
+    pending = deque()
+    
+    def push_ready():
+        while pending and push(pending[0]):
+            pending.popleft()
+    
+    def flush():
+        nonlocal timer
+        if timer is not None:
+            timer.cancel()
+            timer = None
+        push_ready()
+        for start in range(0, len(buf), size):
+            chunk = bytes(buf[start:start + size])
+            # Once anything is waiting, everything after it waits too
+            if pending or not push(chunk):
+                pending.append(chunk)
+        buf.clear()
+    
+    def on_token(token):
+        nonlocal timer
+        if not buf:
+            # A partial phrase goes out after PHRASE_MAX_SECONDS even if
+            # the stream stalls before the next token
+            timer = loop.call_later(PHRASE_MAX_SECONDS, flush)
+        buf.extend(token)
+        
+        # Flush on a sentence boundary or a full phrase
+        if len(buf) >= PHRASE_MAX_BYTES or any(p in token for p in PHRASE_ENDINGS):
+            flush()
+    
+    try:
+        await stream_gemini_response(prompt, on_token, audio)
+    finally:
+        if timer is not None:
+            timer.cancel()
+    
+    if buf:
+        flush()
+    
+    # Ring full means the TTS thread is behind; wait rather than drop
+    while pending:
+        push_ready()
+        if pending:
+            await asyncio.sleep(0.005)
+
+async def call_worker(call):
+    """Per-call Gemini worker task: drains the audio ring and streams responses"""
+    ring = call['ring']
+    prompts = PROMPT_TABLES.get(call.get('industry'), PROMPT_TABLES['restaurant'])
+    last_turn = len(prompts) - 1
+    
+    while True:
+        audio = ring.drain()
+        if not audio:
+            # Idle backoff - the producer never waits on this
+            await asyncio.sleep(0.005)
+            continue
+        
+        # Decode + upsample everything queued in one native pass
+        samples = mulaw_to_pcm16_resample(audio)
+        turn = call['turn']
+        prompt = prompts[turn if turn < last_turn else last_turn]
+        call['turn'] = turn + 1
+        
+        try:
+            # One response at a time; frames keep queueing in the ring meanwhile
+            await handle_stream(call['phrases'], prompt, samples)
+        except Exception as e:
+            print(f"Call worker error: {e}")
+            break
+
+# ═══════════════════════════════════════════════════════════════════════════
+#  TTS + PLAYBACK
+# ═══════════════════════════════════════════════════════════════════════════
+
+AUDIO_RT_PRIORITY = 20
+_rt_warned = False
+
+def pin_realtime():
+    """
+    Move the calling thread to SCHED_FIFO, then onto one core (best effort,
+    Linux only). The core is pinned only once realtime priority is granted:
+    a normal-priority thread stays free to run on any CPU.
+    """
+    global _rt_warned
+    try:
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(AUDIO_RT_PRIORITY))
+    except (AttributeError, OSError) as e:
+        if not _rt_warned:
+            _rt_warned = True
+            print(f"⚠️ Realtime audio thread unavailable ({e}) - running at normal priority")
+        return
+    
+    try:
+        cpu = int(os.getenv('PHONEGENIUS_AUDIO_CPU', max(os.sched_getaffinity(0))))
+        os.sched_setaffinity(0, {cpu})
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Couldn't pin audio thread to a CPU ({e}) - running unpinned")
+
+def synthesize(phrase):
+    """TTS hook: phrase text → outbound audio payload (currently the text itself)"""
+    return phrase
+
+def tts_worker(call):
+    """Per-call TTS thread: phrases → ready-to-send frames in the double buffer"""
+    pin_realtime()
+    
+    # Ring and double buffer were preallocated in _on_start
+    phrases = call['phrases']
+    playback = call['playback']
+    stop = call['stop']
+    frame = media_frame_bytes
+    chunk = MAX_FRAME_AUDIO_BYTES
+    
+    while not stop.is_set():
+        phrase = phrases.pop()
+        if phrase is None:
+            stop.wait(0.002)
+            continue
+        
+        # Real TTS output can be far bigger than one slot: send it as
+        # consecutive media frames rather than one oversized frame
+        audio = synthesize(phrase)
+        for start in range(0, len(audio), chunk):
+            data = frame(audio[start:start + chunk])
+            # Both slots full: the writer is still sending, back off until one frees
+            while not playback.write(data):
+                if stop.wait(0.001):
+                    return
+
+async def ws_writer(ws, call):
+    """Per-call WebSocket writer task: sends frames as the TTS thread readies them"""
+    playback = call['playback']
+    send = ws.send_text
+    backoff = 0.001
+    
+    while True:
+        view = playback.peek()
+        if view is None:
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 0.010)
+            continue
+        
+        backoff = 0.001
+        try:
+            await send(str(view, 'ascii'))
+        except Exception as e:
+            print(f"WebSocket writer error: {e}")
+            break
+        playback.release()
 
 # ═══════════════════════════════════════════════════════════════════════════
 #  TWILIO MEDIA STREAMS WEBSOCKET HANDLER
 # ═══════════════════════════════════════════════════════════════════════════
 
-@sock.route('/media-stream')
-def media_stream(ws):
+def _on_start(message, conn):
+    """'start' event: register the call, spawn its worker, return the opening frame"""
+    call_sid = message['start']['callSid']
+    
+    # make_call already rendered this call's opening frame
+    call = ACTIVE_CALLS.get(call_sid) or {}
+    call.update({
+        'started_ns': time.monotonic_ns(),
+        'transcript': deque(maxlen=TRANSCRIPT_MAX_TURNS),
+        'turn': 0,
+        'ring': SPSCRing(),
+        'phrases': SPSCRing(PHRASE_SLOTS, MAX_PHRASE_BYTES),
+        'playback': DoubleBuffer(),
+        'stop': threading.Event(),
+    })
+    call['worker'] = asyncio.create_task(call_worker(call))
+    call['writer'] = asyncio.create_task(ws_writer(conn['ws'], call))
+    call['tts'] = threading.Thread(target=tts_worker, args=(call,), daemon=True)
+    call['tts'].start()
+    register_call(call_sid, call)
+    conn['call_sid'] = call_sid
+    conn['call'] = call
+    
+    return call.get('opening_frame', DEFAULT_OPENING_FRAME)
+
+def _queue_audio(payload, conn):
+    """Decode a base64 media payload into the call's ring (never blocks)"""
+    call = conn['call']
+    if call is not None:
+        call['ring'].push(a2b_base64(payload, strict_mode=True))
+
+def _on_media(message, conn):
+    """'media' event: queue customer audio for the call worker"""
+    _queue_audio(message['media']['payload'], conn)
+
+# Twilio media frames have a fixed layout, so the hot path slices the
+# payload out of the raw bytes instead of running a JSON parser
+EVENT_OTHER = 0
+EVENT_MEDIA = 1
+_MEDIA_PREFIX = b'{"event":"media"'
+_PAYLOAD_KEY = b'"payload":"'
+
+def parse_twilio_frame(buf):
+    """
+    Return (EVENT_MEDIA, memoryview of the base64 payload) for a media frame.
+    Anything else - other events, unexpected spacing, escaped characters -
+    returns (EVENT_OTHER, None) so the caller falls back to orjson.
+    """
+    if not buf.startswith(_MEDIA_PREFIX):
+        return EVENT_OTHER, None
+    
+    start = buf.find(_PAYLOAD_KEY)
+    if start < 0:
+        return EVENT_OTHER, None
+    start += len(_PAYLOAD_KEY)
+    
+    # The payload's closing quote is the first one after the key. Base64
+    # never contains a quote; a backslash means the encoder escaped '/'.
+    end = buf.find(b'"', start)
+    if end < 0 or buf.find(b'\\', start, end) >= 0:
+        return EVENT_OTHER, None
+    
+    return EVENT_MEDIA, memoryview(buf)[start:end]
+
+# Handlers return an outbound frame to send, or None. Events not listed here
+# ('connected', 'mark', 'stop') are ignored.
+STREAM_HANDLERS = {
+    'start': _on_start,
+    'media': _on_media,
+}
+
+@app.websocket('/media-stream')
+async def media_stream(ws: WebSocket):
     """
     Handle Twilio Media Streams WebSocket connection
     This is MUCH faster than TwiML Gather because:
@@ -194,72 +774,62 @@ def media_stream(ws):
     2. No request/response delay
     3. Stream audio as it's generated
     """
+    await ws.accept()
     print("✓ Media stream connection established")
     
+    # Locals for the per-frame loop (~50 frames/sec per call)
+    loads = orjson.loads
+    parse = parse_twilio_frame
+    queue_audio = _queue_audio
+    receive = ws.receive_text
+    send = ws.send_text
+    handlers = STREAM_HANDLERS
+    conn = {'ws': ws, 'call_sid': None, 'call': None}
+    
     try:
         while True:
-            # Receive audio data from Twilio
-            data = ws.receive()
-            
-            if data is None:
-                break
+            # Receive audio data from Twilio (JSON in text frames)
+            data = await receive()
             
             try:
-                message = json.loads(data)
-                event_type = message.get('event')
+                event, payload = parse(data.encode())
+                if event == EVENT_MEDIA:
+                    queue_audio(payload, conn)
+                    continue
                 
-                if event_type == 'start':
-                    # Call started - stream the opening
-                    call_sid = message.get('start', {}).get('callSid')
-                    ACTIVE_CALLS[call_sid] = {
-                        'started': datetime.now(),
-                        'transcript': []
-                    }
-                    
-                    opening = ELITE_OPENINGS.get('restaurant', "Hello")
-                    # Send opening as streaming audio
-                    ws.send(json.dumps({
-                        'event': 'media',
-                        'media': {'payload': base64.b64encode(opening.encode()).decode()}
-                    }))
-                    
-                elif event_type == 'media':
-                    # Received customer audio - process and respond
-                    payload = base64.b64decode(message['media']['payload'])
-                    
-                    # THIS IS WHERE STREAMING HAPPENS:
-                    # As Gemini generates tokens, stream TTS immediately
-                    # No waiting for full response
-                    
-                    prompt = "Prospect said something. Respond naturally in 1-2 sentences."
-                    
-                    # Stream tokens as they generate
-                    async def handle_stream():
-                        async for token in stream_gemini_response(prompt):
-                            # Send token immediately (don't wait for full response)
-                            ws.send(json.dumps({
-                                'event': 'media',
-                                'media': {'payload': base64.b64encode(token.encode()).decode()}
-                            }))
-                    
-                    # Run async streaming
-                    asyncio.run(handle_stream())
+                message = loads(data)
+                handler = handlers.get(message['event'])
+                if handler is None:
+                    continue
+                
+                frame = handler(message, conn)
+                if frame is not None:
+                    await send(frame)
                     
-            except json.JSONDecodeError:
+            except (orjson.JSONDecodeError, binascii.Error, KeyError):
+                # Skip malformed frames rather than dropping the call
                 continue
     
+    except WebSocketDisconnect:
+        pass
     except Exception as e:
         print(f"Media stream error: {e}")
     finally:
+        call = conn['call']
+        if call is not None:
+            call['worker'].cancel()
+            call['writer'].cancel()
+            call['stop'].set()
+            ACTIVE_CALLS.pop(conn['call_sid'], None)
+            bump_metric('total_minutes', (time.monotonic_ns() - call['started_ns']) / 6e10)
         print("✓ Media stream closed")
 
 # ═══════════════════════════════════════════════════════════════════════════
 #  REST API ENDPOINTS
 # ═══════════════════════════════════════════════════════════════════════════
 
-@app.route('/')
-def index():
-    return render_template_string("""
+# Static page - encoded once at import instead of on every request
+INDEX_HTML = """
     <!DOCTYPE html>
     <html>
     <head>
@@ -310,12 +880,15 @@ def index():
         </script>
     </body>
     </html>
-    """)
+    """.encode()
+
+@app.get('/', response_class=HTMLResponse)
+def index():
+    return HTMLResponse(INDEX_HTML)
 
-@app.route('/api/call/make', methods=['POST'])
-def make_call():
+@app.post('/api/call/make')
+def make_call(data: dict = Body(...)):
     """Make outbound call using Media Streams"""
-    data = request.json
     phone = data.get('phone')
     name = data.get('name')
     industry = data.get('industry', 'restaurant')
@@ -329,42 +902,54 @@ def make_call():
             record=True
         )
         
-        METRICS['calls_made'] += 1
+        # Pre-render the opening so the WebSocket 'start' event just sends it
+        register_call(call.sid, {
+            'industry': industry,
+            'name': name,
+            'opening_frame': render_opening_frame(industry, name),
+        })
+        
+        bump_metric('calls_made')
         
-        return jsonify({
+        return {
             'success': True,
             'call_sid': call.sid,
             'status': 'Media Streams connected (90ms latency)'
-        })
+        }
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)})
+        return {'success': False, 'error': str(e)}
 
-@app.route('/api/metrics', methods=['GET'])
+@app.get('/api/metrics')
 def get_metrics():
-    return jsonify(METRICS)
+    return metrics_snapshot()
 
-@app.route('/api/health', methods=['GET'])
+@app.get('/api/health')
 def health():
-    return jsonify({
+    return {
         'status': 'healthy',
         'architecture': 'Media Streams WebSocket',
         'streaming': 'Gemini tokens + TTS',
         'latency': '90ms'
-    })
+    }
 
-@app.route('/twiml-media', methods=['POST'])
-def twiml_media():
-    """TwiML that connects call to Media Streams WebSocket"""
+def _twiml_media_template():
+    """Build the TwiML once with a {url} placeholder for the request host"""
     response = VoiceResponse()
     
     # Connect call audio to our Media Streams WebSocket
     connect = Connect()
-    connect.media_stream(
-        url=f'wss://{request.host}/media-stream'
-    )
+    connect.stream(url='URL_PLACEHOLDER')
     response.append(connect)
     
-    return str(response), 200, {'Content-Type': 'application/xml'}
+    return str(response).replace('"URL_PLACEHOLDER"', '{url}')
+
+TWIML_MEDIA_TEMPLATE = _twiml_media_template()
+
+@app.post('/twiml-media')
+def twiml_media(request: Request):
+    """TwiML that connects call to Media Streams WebSocket"""
+    url = quoteattr(f'wss://{request.headers["host"]}/media-stream')
+    return Response(TWIML_MEDIA_TEMPLATE.format(url=url), media_type='application/xml')
 
 # ═══════════════════════════════════════════════════════════════════════════
 #  MAIN
@@ -394,5 +979,12 @@ if __name__ == '__main__':
     print("✓ Real-time TTS configured")
     print("\nStarting server on http://localhost:5000\n")
     
-    # For production: use gunicorn or production WSGI server
-    app.run(debug=False, host='0.0.0.0', port=5000)
+    # For production: see Procfile (uvicorn, single worker - call state is in-process)
+    # permessage-deflate off: compressing base64 audio costs more latency than it saves
+    uvicorn.run(
+        app,
+        host='0.0.0.0',
+        port=5000,
+        loop='uvloop' if uvloop else 'asyncio',
+        ws_per_message_deflate=False,
+    )